@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import argparse
+from collections import deque
+from multiprocessing import Pool
+import cv2
+import numpy as np
+from embed_watermark import DCTWatermark
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+MANIFEST_NAME = 'manifest.jsonl'
+_worker = {}
+def _init_worker(watermark, strength, block_size, jpeg_quality):
+    # 每个工作进程只接收一次水印原图；OpenCV 内部线程关掉，核心交给进程池
+    cv2.setNumThreads(1)
+    _worker['watermarker'] = DCTWatermark(strength=strength, block_size=block_size)
+    _worker['watermark'] = watermark
+    _worker['binary'] = {}
+    _worker['jpeg_quality'] = jpeg_quality
+def _watermark_for(shape):
+    # 缩放+二值化后的水印按块网格尺寸缓存，同尺寸图片只算一次
+    watermarker = _worker['watermarker']
+    key = (shape[0] // watermarker.block_size, shape[1] // watermarker.block_size)
+    binary = _worker['binary'].get(key)
+    if binary is None:
+        binary = _worker['binary'][key] = watermarker.binarize_watermark(_worker['watermark'], shape)
+    return binary
+def _process_image(src, dst, rel):
+    start = time.perf_counter()
+    try:
+        host = cv2.imread(src, cv2.IMREAD_COLOR)
+        if host is None:
+            raise ValueError("无法解码图像")
+        watermarker = _worker['watermarker']
+        binary = _watermark_for(host.shape)
+        marked = watermarker.embed(host, None, binary)
+        ext = os.path.splitext(dst)[1].lower()
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), _worker['jpeg_quality']] if ext in ('.jpg', '.jpeg') else []
+        ok, encoded = cv2.imencode(ext, marked, params)
+        if not ok:
+            raise ValueError("无法编码图像")
+        # 先写临时文件再改名，中断时不会留下半张图
+        tmp = dst + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp, dst)
+        # 校验：对编码后的结果重新解码提取，与嵌入的比特逐位比较
+        coeffs = watermarker.extract_coefficients(cv2.imdecode(encoded, cv2.IMREAD_COLOR))
+        accuracy = float(np.mean((coeffs > coeffs.mean()) == (binary > 0)))
+        return {'file': rel, 'status': 'ok', 'bit_accuracy': accuracy, 'seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'file': rel, 'status': 'error', 'error': str(e), 'seconds': time.perf_counter() - start}
+def iter_images(input_dir):
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+def load_manifest(path):
+    # 只有成功的记录算完成；失败的文件在下次运行时重试，末尾不完整的行忽略
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('status') == 'ok':
+                    done.add(entry['file'])
+    return done
+def run_batch(input_dir, output_dir, watermark_path, strength=0.2, block_size=8, processes=None,
+              max_pending=None, jpeg_quality=95, manifest_path=None, min_accuracy=0.9):
+    watermark = cv2.imread(watermark_path, cv2.IMREAD_GRAYSCALE)
+    if watermark is None:
+        raise FileNotFoundError(watermark_path)
+    processes = processes or os.cpu_count() or 1
+    max_pending = max_pending or 4 * processes
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+    done = load_manifest(manifest_path)
+    summary = {'processed': 0, 'skipped': 0, 'failed': 0, 'low_accuracy': 0}
+    start = time.perf_counter()
+    with open(manifest_path, 'a') as manifest, \
+            Pool(processes, initializer=_init_worker, initargs=(watermark, strength, block_size, jpeg_quality)) as pool:
+        def record(result):
+            manifest.write(json.dumps(result, ensure_ascii=False) + '\n')
+            manifest.flush()
+            if result['status'] != 'ok':
+                summary['failed'] += 1
+                print(f"失败: {result['file']} ({result['error']})")
+                return
+            summary['processed'] += 1
+            if result['bit_accuracy'] < min_accuracy:
+                summary['low_accuracy'] += 1
+                print(f"校验未通过: {result['file']} (比特正确率 {result['bit_accuracy']:.3f})")
+        # 在途任务数有上限：解码/编码 I/O 与嵌入在各进程中重叠进行，内存不随目录大小增长
+        pending = deque()
+        for rel in iter_images(input_dir):
+            if rel in done:
+                summary['skipped'] += 1
+                continue
+            dst = os.path.join(output_dir, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            pending.append(pool.apply_async(_process_image, (os.path.join(input_dir, rel), dst, rel)))
+            if len(pending) > max_pending:
+                record(pending.popleft().get())
+        while pending:
+            record(pending.popleft().get())
+    elapsed = time.perf_counter() - start
+    summary['seconds'] = elapsed
+    summary['processes'] = processes
+    summary['images_per_sec'] = summary['processed'] / elapsed if elapsed else 0.0
+    summary['images_per_sec_per_core'] = summary['images_per_sec'] / processes
+    return summary
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量为目录中的图片嵌入 DCT 水印并校验")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--watermark', required=True)
+    parser.add_argument('--strength', type=float, default=0.2)
+    parser.add_argument('--block-size', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--jpeg-quality', type=int, default=95)
+    parser.add_argument('--manifest', default=None)
+    parser.add_argument('--min-accuracy', type=float, default=0.9)
+    args = parser.parse_args(argv)
+    summary = run_batch(args.input_dir, args.output_dir, args.watermark, args.strength, args.block_size,
+                        args.processes, args.max_pending, args.jpeg_quality, args.manifest, args.min_accuracy)
+    print(f"\n完成: {summary['processed']} 张, 跳过(已完成): {summary['skipped']} 张, "
+          f"失败: {summary['failed']} 张, 校验未通过: {summary['low_accuracy']} 张")
+    print(f"耗时 {summary['seconds']:.2f}s, 吞吐 {summary['images_per_sec']:.1f} 张/秒, "
+          f"每核 {summary['images_per_sec_per_core']:.1f} 张/秒 ({summary['processes']} 进程)")
+    return summary
+if __name__ == "__main__":
+    main()
\ No newline at end of file
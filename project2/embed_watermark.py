@@ -8,42 +8,78 @@ class DCTWatermark:
         self.block_size = block_size
         self.seed = seed
         np.random.seed(seed)
-    def _get_dct_blocks(self, img):
-        h, w = img.shape
-        blocks = []
-        for y in range(0, h, self.block_size):
-            for x in range(0, w, self.block_size):
-                block = img[y:y+self.block_size, x:x+self.block_size]
-                if block.shape == (self.block_size, self.block_size):
-                    blocks.append((y, x, block))
-        return blocks
-    def embed(self, host_img, watermark):
-        yuv = cv2.cvtColor(host_img, cv2.COLOR_BGR2YUV)
+    @staticmethod
+    def _dct_matrix(n):
+        # 正交 DCT-II 矩阵 C，满足 cv2.dct(X) == C @ X @ C.T
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        C = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+        C[0, :] = np.sqrt(1.0 / n)
+        return C
+    def _basis(self, pos_y, pos_x):
+        # 单个系数 (pos_y, pos_x) 对应的 8×8 空域基图像：idct(e_uv) = outer(C[u], C[v])
+        C = self._dct_matrix(self.block_size)
+        return np.outer(C[pos_y], C[pos_x]).astype(np.float32)
+    def _block_view(self, img):
+        # 所有完整块的 (H/8, W/8, 8, 8) 跨步视图，不复制数据
+        bs = self.block_size
+        hb, wb = img.shape[0] // bs, img.shape[1] // bs
+        return img[:hb*bs, :wb*bs].reshape(hb, bs, wb, bs).swapaxes(1, 2)
+    def binarize_watermark(self, watermark, shape):
+        # 按宿主图像的块网格缩放并二值化水印，同尺寸的图像可复用结果
+        wm_resized = cv2.resize(watermark, (shape[1]//self.block_size, shape[0]//self.block_size))
+        return (wm_resized > 128).astype(np.float32) * 2 - 1  # 转换为[-1, 1]
+    def _embed_strip(self, strip, wm_rows):
+        yuv = cv2.cvtColor(strip, cv2.COLOR_BGR2YUV)
         Y = yuv[:, :, 0].astype(np.float32)
-        wm_resized = cv2.resize(watermark, (Y.shape[1]//self.block_size, Y.shape[0]//self.block_size))
-        wm_binary = (wm_resized > 128).astype(np.float32) * 2 - 1  # 转换为[-1, 1]
-        blocks = self._get_dct_blocks(Y)
-        watermarked_Y = Y.copy()
-        for idx, (y, x, block) in enumerate(blocks):
-            dct_block = cv2.dct(block)
-            pos_x, pos_y = 3, 4
-            if idx < wm_binary.size:
-                dct_block[pos_y, pos_x] += self.strength * wm_binary.flat[idx]
-            watermarked_block = cv2.idct(dct_block)
-            watermarked_Y[y:y+self.block_size, x:x+self.block_size] = watermarked_block
-        yuv[:, :, 0] = np.clip(watermarked_Y, 0, 255)
+        pos_x, pos_y = 3, 4
+        # 只修改一个 DCT 系数，等价于在空域每块叠加 strength * wm * 对应基图像，无需逐块 DCT/IDCT
+        blocks = self._block_view(Y)
+        blocks += (self.strength * wm_rows)[:, :, None, None] * self._basis(pos_y, pos_x)
+        yuv[:, :, 0] = np.clip(Y, 0, 255)
         return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
-    def extract(self, watermarked_img, watermark_shape):
+    def embed(self, host_img, watermark, wm_binary=None):
+        if wm_binary is None:
+            wm_binary = self.binarize_watermark(watermark, host_img.shape)
+        return self._embed_strip(host_img, wm_binary)
+    def embed_tiled(self, host_img, watermark, out=None, strip_rows=512, wm_binary=None):
+        # 按与块对齐的水平条带处理，峰值内存约为一个条带；host_img/out 可以是 np.memmap
+        if wm_binary is None:
+            wm_binary = self.binarize_watermark(watermark, host_img.shape)
+        if out is None:
+            out = np.empty_like(host_img)
+        bs = self.block_size
+        strip_rows = max(bs, strip_rows // bs * bs)
+        for top in range(0, host_img.shape[0], strip_rows):
+            bottom = min(top + strip_rows, host_img.shape[0])
+            # 条带内的块行对应水印的第 top/bs 行起的切片
+            wm_rows = wm_binary[top // bs: top // bs + (bottom - top) // bs]
+            out[top:bottom] = self._embed_strip(np.ascontiguousarray(host_img[top:bottom]), wm_rows)
+        return out
+    @staticmethod
+    def open_raw(path, shape, mode='r'):
+        # 原始 BGR uint8 缓冲区（H×W×3，无文件头）的内存映射
+        return np.memmap(path, dtype=np.uint8, mode=mode, shape=tuple(shape))
+    def embed_raw_file(self, src_path, dst_path, shape, watermark, strip_rows=512):
+        src = self.open_raw(src_path, shape, 'r')
+        dst = self.open_raw(dst_path, shape, 'w+')
+        self.embed_tiled(src, watermark, dst, strip_rows)
+        dst.flush()
+        del src, dst
+    def extract_coefficients(self, watermarked_img):
         yuv = cv2.cvtColor(watermarked_img, cv2.COLOR_BGR2YUV)
         Y = yuv[:, :, 0].astype(np.float32)
+        pos_x, pos_y = 3, 4
+        # 每块只需要 [4,3] 系数：与基图像做点积即可，不做完整 DCT
+        return np.einsum('ijkl,kl->ij', self._block_view(Y), self._basis(pos_y, pos_x))
+    def extract(self, watermarked_img, watermark_shape):
+        return self.threshold_coefficients(self.extract_coefficients(watermarked_img), watermark_shape)
+    @staticmethod
+    def threshold_coefficients(coeffs, watermark_shape):
         extracted = np.zeros(watermark_shape, dtype=np.float32).flatten()
-        blocks = self._get_dct_blocks(Y)
-        for idx, (y, x, block) in enumerate(blocks):
-            if idx >= extracted.size:
-                break
-            dct_block = cv2.dct(block)
-            pos_x, pos_y = 3, 4
-            extracted[idx] = dct_block[pos_y, pos_x]
+        coeffs = coeffs.ravel()
+        count = min(extracted.size, coeffs.size)
+        extracted[:count] = coeffs[:count]
         extracted = extracted.reshape(watermark_shape)
         return (extracted > extracted.mean()).astype(np.uint8) * 255
 from skimage.metrics import structural_similarity as ssim
@@ -66,21 +102,29 @@ def compare_images(img1, img2):
         win_size=3
     )
     return psnr, ssim_val
+def jpeg_attack(img, quality=30):
+    _, encimg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return cv2.imdecode(encimg, 1)
+def rotate_attack(img, angle=5):
+    M = cv2.getRotationMatrix2D((img.shape[1]//2, img.shape[0]//2), angle, 1)
+    return cv2.warpAffine(img, M, (img.shape[1], img.shape[0]))
+def noise_attack(img, var=0.01, rng=None):
+    return (random_noise(img, mode='gaussian', var=var, rng=rng) * 255).astype(np.uint8)
+def crop_attack(img, ratio=0.125):
+    # 四周各裁去 ratio 后缩放回原尺寸
+    h, w = img.shape[:2]
+    dy, dx = int(h * ratio), int(w * ratio)
+    return cv2.resize(img[dy:h-dy, dx:w-dx], (w, h))
 def apply_attacks(img):
     attacked = {}
     attacked['flipped'] = cv2.flip(img, 1)
     M = np.float32([[1, 0, 20], [0, 1, 20]])
     attacked['translated'] = cv2.warpAffine(img, M, (img.shape[1], img.shape[0]))
-    h, w = img.shape[:2]
-    cropped = img[h//8:h-h//8, w//8:w-w//8]
-    attacked['cropped'] = cv2.resize(cropped, (w, h))
+    attacked['cropped'] = crop_attack(img, 0.125)
     attacked['contrast'] = np.clip(img * 1.5, 0, 255).astype(np.uint8)
-    attacked['noisy'] = (random_noise(img, mode='gaussian', var=0.01) * 255).astype(np.uint8)
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 30]
-    _, encimg = cv2.imencode('.jpg', img, encode_param)
-    attacked['jpeg'] = cv2.imdecode(encimg, 1)
-    M = cv2.getRotationMatrix2D((img.shape[1]//2, img.shape[0]//2), 5, 1)
-    attacked['rotated'] = cv2.warpAffine(img, M, (img.shape[1], img.shape[0]))
+    attacked['noisy'] = noise_attack(img, 0.01)
+    attacked['jpeg'] = jpeg_attack(img, 30)
+    attacked['rotated'] = rotate_attack(img, 5)
     return attacked
 def main():
     host = cv2.imread(r'C:\Users\Thinkpad\Desktop\projects\project2\host_image.jpg')
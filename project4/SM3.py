@@ -1,15 +1,86 @@
+import os
+import mmap
 import struct
 import threading
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from queue import Queue
 import time
 from math import log2, ceil
 from typing import List, Tuple
+try:
+    import numpy as np
+except ImportError:
+    np = None
+def _build_compress_fast(t_rot):
+    # 生成完全展开的压缩函数：消息字和寄存器都放在局部变量里，每轮通过重命名寄存器代替移位赋值；
+    # 循环移位用 x * 0x100000001 把字复制到高 32 位后一次右移完成，P0/P1 中的两次移位共用一次掩码。
+    # a12、ss1 和轮换后的 B、F 只会再参与加法/位运算并在之后被截断，因此不单独取低 32 位
+    def rotl(x, n):
+        return f"((({x} * 0x100000001) >> {32 - n}) & 0xFFFFFFFF)"
+    def rounds(indent, w1):
+        lines = []
+        A, B, C, D, E, F, G, H = "abcdefgh"
+        for j in range(64):
+            ff = f"({A} ^ {B} ^ {C})" if j < 16 else f"(({A} & ({B} | {C})) | ({B} & {C}))"
+            gg = f"({E} ^ {F} ^ {G})" if j < 16 else f"((({F} ^ {G}) & {E}) ^ {G})"
+            lines.append(f"{indent}a12 = ({A} * 0x100000001) >> 20")
+            lines.append(f"{indent}ss1 = (((a12 + {E} + {t_rot[j]:#010x}) & 0xFFFFFFFF) * 0x100000001) >> 25")
+            lines.append(f"{indent}{D} = ({ff} + {D} + (ss1 ^ a12) + {w1(j)}) & 0xFFFFFFFF")
+            lines.append(f"{indent}x = ({gg} + {H} + ss1 + w{j}) & 0xFFFFFFFF")
+            lines.append(f"{indent}xx = x * 0x100000001")
+            lines.append(f"{indent}{H} = x ^ (((xx >> 23) ^ (xx >> 15)) & 0xFFFFFFFF)")
+            lines.append(f"{indent}{B} = ({B} * 0x100000001) >> 23")
+            lines.append(f"{indent}{F} = ({F} * 0x100000001) >> 13")
+            A, B, C, D, E, F, G, H = D, A, B, C, H, E, F, G
+        feed = ", ".join(f"V{i} ^ ({r} & 0xFFFFFFFF)" for i, r in enumerate((A, B, C, D, E, F, G, H)))
+        return lines, feed
+    registers = "V0, V1, V2, V3, V4, V5, V6, V7"
+    # 单块版本：消息扩展也在函数内完成，直接从缓冲区的 offset 处解包
+    lines = ["def _compress_fast(V, block, offset=0, _unpack_from=_unpack_from):"]
+    lines.append("    " + ", ".join(f"w{j}" for j in range(16)) + " = _unpack_from(block, offset)")
+    for j in range(16, 68):
+        lines.append(f"    x = w{j-16} ^ w{j-9} ^ {rotl(f'w{j-3}', 15)}")
+        lines.append("    xx = x * 0x100000001")
+        lines.append(f"    w{j} = x ^ (((xx >> 17) ^ (xx >> 9)) & 0xFFFFFFFF) ^ {rotl(f'w{j-13}', 7)} ^ w{j-6}")
+    lines.append(f"    {registers} = a, b, c, d, e, f, g, h = V")
+    body, feed = rounds("    ", lambda j: f"(w{j} ^ w{j+4})")
+    lines += body
+    lines.append(f"    return [{feed}]")
+    # 批量版本：每行是 numpy 预先扩展好的 W0..W63 与 W'0..W'63，寄存器在多块之间保持为局部变量
+    lines.append("def _compress_expanded(V, rows):")
+    lines.append(f"    {registers} = V")
+    lines.append("    for row in rows:")
+    lines.append("        " + ", ".join([f"w{j}" for j in range(64)] + [f"p{j}" for j in range(64)]) + " = row")
+    lines.append(f"        a, b, c, d, e, f, g, h = {registers}")
+    body, feed = rounds("        ", lambda j: f"p{j}")
+    lines += body
+    lines.append(f"        {registers} = {feed}")
+    lines.append(f"    return [{registers}]")
+    namespace = {'_unpack_from': struct.Struct('>16I').unpack_from}
+    exec("\n".join(lines), namespace)
+    return namespace['_compress_fast'], namespace['_compress_expanded']
 class SM3:
     IV = [
         0x7380166F, 0x4914B2B9, 0x172442D7, 0xDA8A0600,
         0xA96F30BC, 0x163138AA, 0xE38DEE4D, 0xB0FB0E4E
     ]
     T = [0x79CC4519 if j < 16 else 0x7A879D8A for j in range(64)]
+    T_ROT = [((t << (j % 32)) | (t >> (32 - j % 32))) & 0xFFFFFFFF for j, t in enumerate(T)]
+    _compress_fast, _compress_expanded = (staticmethod(f) for f in _build_compress_fast(T_ROT))
+    _T_LANES = np.array(T_ROT, dtype=np.uint32) if np is not None else None
+    MIN_LANES = 16
+    EXPAND_MIN_BLOCKS = 32
+    EXPAND_CHUNK_BLOCKS = 1024
+    name = 'sm3'
+    digest_size = 32
+    block_size = 64
+    def __init__(self, data: bytes = b'', iv=None):
+        self._V = list(iv) if iv else self.IV.copy()
+        self._buffer = bytearray()
+        self._length = 0
+        if data:
+            self.update(data)
     @staticmethod
     def left_rotate(x, n):
         return ((x << n) | (x >> (32 - n))) & 0xFFFFFFFF
@@ -26,35 +97,182 @@ class SM3:
     def P1(X):
         return X ^ SM3.left_rotate(X, 15) ^ SM3.left_rotate(X, 23)
     @staticmethod
-    def padding(msg):
-        length = len(msg) * 8
-        msg += b'\x80'
-        while (len(msg) % 64) != 56:
-            msg += b'\x00'
-        msg += struct.pack('>Q', length)
-        return msg
+    def padding(msg, length=None):
+        if length is None:
+            length = len(msg)
+        return bytes(msg) + b'\x80' + b'\x00' * ((55 - length) % 64) + struct.pack('>Q', (length * 8) & 0xFFFFFFFFFFFFFFFF)
     @classmethod
     def hash(cls, msg: bytes, iv=None) -> bytes:
         msg = cls.padding(msg)
         blocks = [msg[i:i+64] for i in range(0, len(msg), 64)]
         V = iv.copy() if iv else cls.IV.copy()
         for block in blocks:
-            W = [0] * 68
-            for j in range(16):
-                W[j] = struct.unpack('>I', block[j*4:j*4+4])[0]
-            for j in range(16, 68):
-                W[j] = cls.P1(W[j-16] ^ W[j-9] ^ cls.left_rotate(W[j-3], 15)) ^ cls.left_rotate(W[j-13], 7) ^ W[j-6]
-            W1 = [W[j] ^ W[j+4] for j in range(64)]
-            A, B, C, D, E, F, G, H = V
-            for j in range(64):
-                SS1 = cls.left_rotate((cls.left_rotate(A, 12) + E + cls.T[j]) & 0xFFFFFFFF, 7)
-                SS2 = SS1 ^ cls.left_rotate(A, 12)
-                TT1 = (cls.FF_j(A, B, C, j) + D + SS2 + W1[j]) & 0xFFFFFFFF
-                TT2 = (cls.GG_j(E, F, G, j) + H + SS1 + W[j]) & 0xFFFFFFFF
-                D, C, B, A = C, cls.left_rotate(B, 9), A, TT1
-                H, G, F, E = G, cls.left_rotate(F, 19), E, cls.P0(TT2)
-            V = [(x ^ y) & 0xFFFFFFFF for x, y in zip(V, [A, B, C, D, E, F, G, H])]
+            V = cls._compress(V, block)
         return b''.join(struct.pack('>I', x) for x in V)
+    @classmethod
+    def hash_fast(cls, msg: bytes, iv=None) -> bytes:
+        return cls(msg, iv=iv).digest()
+    @classmethod
+    def _compress(cls, V, block):
+        W = [0] * 68
+        for j in range(16):
+            W[j] = struct.unpack('>I', block[j*4:j*4+4])[0]
+        for j in range(16, 68):
+            W[j] = cls.P1(W[j-16] ^ W[j-9] ^ cls.left_rotate(W[j-3], 15)) ^ cls.left_rotate(W[j-13], 7) ^ W[j-6]
+        W1 = [W[j] ^ W[j+4] for j in range(64)]
+        A, B, C, D, E, F, G, H = V
+        for j in range(64):
+            SS1 = cls.left_rotate((cls.left_rotate(A, 12) + E + cls.left_rotate(cls.T[j], j % 32)) & 0xFFFFFFFF, 7)
+            SS2 = SS1 ^ cls.left_rotate(A, 12)
+            TT1 = (cls.FF_j(A, B, C, j) + D + SS2 + W1[j]) & 0xFFFFFFFF
+            TT2 = (cls.GG_j(E, F, G, j) + H + SS1 + W[j]) & 0xFFFFFFFF
+            D, C, B, A = C, cls.left_rotate(B, 9), A, TT1
+            H, G, F, E = G, cls.left_rotate(F, 19), E, cls.P0(TT2)
+        return [(x ^ y) & 0xFFFFFFFF for x, y in zip(V, [A, B, C, D, E, F, G, H])]
+    @classmethod
+    def hash_many(cls, messages, iv=None, batch_size: int = 1 << 16) -> List[bytes]:
+        # 按填充后的分组数把消息分组，每组内的消息作为 uint32 数组的不同通道一起压缩
+        messages = list(messages)
+        if np is None:
+            return [cls.hash_fast(msg, iv=iv) for msg in messages]
+        results = [None] * len(messages)
+        groups = {}
+        for i, msg in enumerate(messages):
+            groups.setdefault((len(msg) + 72) // 64, []).append(i)
+        init = np.array(iv if iv else cls.IV, dtype=np.uint32)[:, None]
+        for n_blocks, indices in groups.items():
+            if len(indices) < cls.MIN_LANES:
+                for i in indices:
+                    results[i] = cls.hash_fast(messages[i], iv=iv)
+                continue
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start+batch_size]
+                padded = b''.join(cls.padding(messages[i]) for i in batch)
+                words = np.frombuffer(padded, dtype='>u4').astype(np.uint32).reshape(len(batch), n_blocks, 16)
+                V = np.repeat(init, len(batch), axis=1)
+                for b in range(n_blocks):
+                    V = cls._compress_lanes(V, words[:, b, :].T)
+                out = V.T.astype('>u4').tobytes()
+                for k, i in enumerate(batch):
+                    results[i] = out[k*32:k*32+32]
+        return results
+    @classmethod
+    def _compress_lanes(cls, V, W):
+        def rotl(x, n):
+            return (x << n) | (x >> (32 - n))
+        T = cls._T_LANES
+        W = list(W)
+        for j in range(16, 68):
+            x = W[j-16] ^ W[j-9] ^ rotl(W[j-3], 15)
+            W.append(x ^ rotl(x, 15) ^ rotl(x, 23) ^ rotl(W[j-13], 7) ^ W[j-6])
+        A, B, C, D, E, F, G, H = V
+        for j in range(64):
+            a12 = rotl(A, 12)
+            SS1 = rotl(a12 + E + T[j], 7)
+            if j < 16:
+                ff = A ^ B ^ C
+                gg = E ^ F ^ G
+            else:
+                ff = (A & B) | (A & C) | (B & C)
+                gg = (E & F) | (~E & G)
+            TT1 = ff + D + (SS1 ^ a12) + (W[j] ^ W[j+4])
+            TT2 = gg + H + SS1 + W[j]
+            D, C, B, A = C, rotl(B, 9), A, TT1
+            H, G, F, E = G, rotl(F, 19), E, TT2 ^ rotl(TT2, 9) ^ rotl(TT2, 17)
+        return V ^ np.stack([A, B, C, D, E, F, G, H])
+    @staticmethod
+    def _expand_blocks(data) -> List[List[int]]:
+        # 消息扩展只依赖分组本身，各分组相互独立：按列在 numpy 中一次算完，每行给出 W0..W63 与 W'0..W'63
+        W = np.empty((132, len(data) // 64), dtype=np.uint32)
+        W[:16] = np.frombuffer(data, dtype='>u4').reshape(-1, 16).T
+        def rotl(x, n):
+            return (x << np.uint32(n)) | (x >> np.uint32(32 - n))
+        for j in range(16, 68):
+            x = W[j-16] ^ W[j-9] ^ rotl(W[j-3], 15)
+            W[j] = x ^ rotl(x, 15) ^ rotl(x, 23) ^ rotl(W[j-13], 7) ^ W[j-6]
+        np.bitwise_xor(W[:64], W[4:68], out=W[68:])
+        return np.concatenate([W[:64], W[68:]]).T.tolist()
+    def update(self, data: bytes) -> None:
+        data = memoryview(data).cast('B')
+        self._length += len(data)
+        if self._buffer:
+            need = 64 - len(self._buffer)
+            self._buffer += data[:need]
+            data = data[need:]
+            if len(self._buffer) < 64:
+                return
+            self._V = self._compress_fast(self._V, bytes(self._buffer))
+            self._buffer = bytearray()
+        end = len(data) - len(data) % 64
+        V = self._V
+        compress = self._compress_fast
+        i = 0
+        if np is not None:
+            chunk = self.EXPAND_CHUNK_BLOCKS * 64
+            while end - i >= self.EXPAND_MIN_BLOCKS * 64:
+                j = min(i + chunk, end)
+                V = self._compress_expanded(V, self._expand_blocks(data[i:j]))
+                i = j
+        for i in range(i, end, 64):
+            V = compress(V, data, i)
+        self._V = V
+        self._buffer = bytearray(data[end:])
+    def digest(self) -> bytes:
+        tail = self.padding(self._buffer, self._length)
+        V = self._V
+        for i in range(0, len(tail), 64):
+            V = self._compress_fast(V, tail[i:i+64])
+        return b''.join(struct.pack('>I', x) for x in V)
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+    def copy(self) -> 'SM3':
+        other = self.__class__.__new__(self.__class__)
+        other._V = self._V.copy()
+        other._buffer = self._buffer.copy()
+        other._length = self._length
+        return other
+    @classmethod
+    def hash_file(cls, path, chunk_size: int = 1 << 20, use_mmap: bool = False, iv=None) -> bytes:
+        h = cls(iv=iv)
+        with open(path, 'rb') as f:
+            if use_mmap:
+                size = os.fstat(f.fileno()).st_size
+                if size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            for i in range(0, size, chunk_size):
+                                h.update(view[i:i+chunk_size])
+            else:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    h.update(chunk)
+        return h.digest()
+TEST_VECTORS = [
+    (b"abc", "66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0"),
+    (b"abcd" * 16, "debe9ff92275b8a138604889c18e5a4d6fdb70e5387e5765293dcba39c0c5732"),
+]
+def compare_performance(size=1 << 20, rounds=3):
+    print("\n" + "="*50)
+    print("Task 2: SM3 Fast Compression Benchmark")
+    print("="*50)
+    for msg, expected in TEST_VECTORS:
+        ok = SM3.hash(msg).hex() == expected and SM3.hash_fast(msg).hex() == expected
+        print(f"GB/T 32905 vector {msg[:8]!r}{'...' if len(msg) > 8 else ''}: {'passed' if ok else 'failed'}")
+    data = bytes(range(256)) * (size // 256)
+    results = {}
+    for name, func in [('reference', SM3.hash), ('fast', SM3.hash_fast)]:
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            digest = func(data)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, digest)
+    ref_time, ref_digest = results['reference']
+    fast_time, fast_digest = results['fast']
+    print(f"Input size: {len(data)} bytes")
+    print(f"Reference SM3.hash: {ref_time*1000:.1f}ms ({len(data)/ref_time/2**20:.2f} MB/s)")
+    print(f"Fast SM3.hash_fast: {fast_time*1000:.1f}ms ({len(data)/fast_time/2**20:.2f} MB/s)")
+    print(f"Speedup: {ref_time/fast_time:.2f}x, digests {'match' if ref_digest == fast_digest else 'differ'}")
+    return ref_time / fast_time
 def length_extension_attack():
     print("\n" + "="*50)
     print("SM3 Length Extension Attack Verification")
@@ -74,53 +292,409 @@ def length_extension_attack():
     print(f"Forged hash:  {forged_hash.hex()}")
     print(f"Legit hash:   {legit_hash.hex()}")
     print(f"Attack {'succeeded' if forged_hash == legit_hash else 'failed'}!")
+def _build_subtree(data: List[bytes], height: int) -> List[bytes]:
+    # 子进程只回传每层拼接好的字节串，由主进程拷贝到整棵树缓冲区的对应偏移
+    nodes = MerkleTree._hash_leaves(data)
+    levels = [b''.join(nodes)]
+    for _ in range(height):
+        nodes = MerkleTree._hash_level(nodes)
+        levels.append(b''.join(nodes))
+    return levels
+class MerkleLevel:
+    # 某一层节点在连续缓冲区中的只读视图，下标访问返回 32 字节摘要
+    def __init__(self, buf, start: int, size: int):
+        self._buf = buf
+        self._start = start
+        self.size = size
+    def __len__(self):
+        return self.size
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("Merkle level index out of range")
+        pos = self._start + index * 32
+        return bytes(self._buf[pos:pos+32])
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+    def __eq__(self, other):
+        return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+    def tobytes(self) -> bytes:
+        return bytes(self._buf[self._start:self._start + self.size * 32])
 class MerkleTree:
-    def __init__(self, data: List[bytes]):
-        self.leaves = [self._hash_leaf(d) for d in data]
-        self.tree = self.build_tree(self.leaves)
-        self.root = self.tree[-1][0] if self.tree else b''
+    MAGIC = b'SM3MRKL1'
+    HEADER = struct.Struct('>8sQ')
+    def __init__(self, data: List[bytes], workers: int = None, chunk_size: int = None):
+        if workers and workers > 1:
+            self._set_storage(*self.build_tree_parallel(data, workers, chunk_size))
+        else:
+            self._set_storage(*self._build_packed(self._hash_leaves(data)))
+    @staticmethod
+    def level_sizes(n: int) -> List[int]:
+        sizes = [n]
+        while n > 1:
+            n = (n + 1) // 2
+            sizes.append(n)
+        return sizes
+    def _set_storage(self, buf, n: int, base: int = 0):
+        self._buf = buf
+        self.size = n
+        self.tree = []
+        offset = base
+        for size in self.level_sizes(n):
+            self.tree.append(MerkleLevel(buf, offset, size))
+            offset += size * 32
+        self.leaves = self.tree[0]
+        self.root = self.tree[-1][0] if n else b''
+    def _build_packed(self, nodes: List[bytes]):
+        # 逐层哈希并直接写入同一块 bytearray，任意时刻只保留当前层的 bytes 列表
+        sizes = self.level_sizes(len(nodes))
+        buf = bytearray(32 * sum(sizes))
+        offset = 0
+        for size in sizes:
+            buf[offset:offset + size * 32] = b''.join(nodes)
+            offset += size * 32
+            if size > 1:
+                nodes = self._hash_level(nodes)
+        return buf, sizes[0]
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.size))
+            for level in self.tree:
+                f.write(level.tobytes())
+    @classmethod
+    def open(cls, path) -> 'MerkleTree':
+        # 只读映射已保存的树，证明生成按需从页缓存读取节点，无需重建或整体载入
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = cls.HEADER.unpack(mm[:cls.HEADER.size])
+        if magic != cls.MAGIC:
+            mm.close()
+            raise ValueError(f"{path} is not a saved MerkleTree")
+        if len(mm) != cls.HEADER.size + 32 * sum(cls.level_sizes(n)):
+            mm.close()
+            raise ValueError(f"{path} is truncated")
+        tree = cls.__new__(cls)
+        tree._set_storage(mm, n, cls.HEADER.size)
+        return tree
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
     @staticmethod
     def _hash_leaf(data: bytes) -> bytes:
-        return SM3.hash(b'\x00' + data)
+        return SM3.hash_fast(b'\x00' + data)
     @staticmethod
     def _hash_node(left: bytes, right: bytes) -> bytes:
-        return SM3.hash(b'\x01' + left + right)
+        return SM3.hash_fast(b'\x01' + left + right)
+    @staticmethod
+    def _hash_leaves(data: List[bytes]) -> List[bytes]:
+        return SM3.hash_many(b'\x00' + d for d in data)
+    @staticmethod
+    def _hash_level(nodes: List[bytes]) -> List[bytes]:
+        pairs = []
+        for i in range(0, len(nodes), 2):
+            left = nodes[i]
+            right = nodes[i+1] if i+1 < len(nodes) else nodes[i]
+            pairs.append(b'\x01' + left + right)
+        return SM3.hash_many(pairs)
     def build_tree(self, nodes: List[bytes]) -> List[List[bytes]]:
         tree = [nodes]
         while len(nodes) > 1:
-            next_level = []
-            for i in range(0, len(nodes), 2):
-                left = nodes[i]
-                right = nodes[i+1] if i+1 < len(nodes) else nodes[i]
-                next_level.append(self._hash_node(left, right))
+            next_level = self._hash_level(nodes)
             tree.append(next_level)
             nodes = next_level
         return tree
+    def build_tree_parallel(self, data: List[bytes], workers: int, chunk_size: int = None):
+        # 每个进程构建一棵 2^height 个叶子的完整子树，块边界与子树边界对齐，根结果与串行构建逐位一致。
+        # 整棵树的缓冲区按 level_sizes 预先分配，子树结果到达后逐层拷贝到各层偏移，不再二次拼接
+        if chunk_size is None:
+            chunk_size = len(data) / (workers * 4)
+        height = max(0, ceil(log2(max(chunk_size, 1))))
+        chunk_size = 1 << height
+        if len(data) <= chunk_size:
+            return self._build_packed(self._hash_leaves(data))
+        sizes = self.level_sizes(len(data))
+        offsets = [0]
+        for size in sizes[:-1]:
+            offsets.append(offsets[-1] + size * 32)
+        buf = bytearray(32 * sum(sizes))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_build_subtree, data[i:i+chunk_size], height): i
+                       for i in range(0, len(data), chunk_size)}
+            for future in as_completed(futures):
+                start = futures[future]
+                for depth, level in enumerate(future.result()):
+                    pos = offsets[depth] + (start >> depth) * 32
+                    buf[pos:pos + len(level)] = level
+        # 块根以上只剩少量节点，在主进程中继续逐层写入同一缓冲区
+        nodes = MerkleLevel(buf, offsets[height], sizes[height])[:]
+        for depth in range(height + 1, len(sizes)):
+            nodes = self._hash_level(nodes)
+            buf[offsets[depth]:offsets[depth] + sizes[depth] * 32] = b''.join(nodes)
+        return buf, sizes[0]
     def get_proof(self, index: int) -> List[Tuple[bytes, bool]]:
         proof = []
         idx = index
         for layer in self.tree[:-1]:
             sibling_idx = idx + 1 if idx % 2 == 0 else idx - 1
-            if sibling_idx < len(layer):
-                proof.append((layer[sibling_idx], idx % 2 == 0))
+            if sibling_idx >= len(layer):
+                sibling_idx = idx
+            proof.append((layer[sibling_idx], idx % 2 == 1))
             idx = idx // 2
         return proof
     def verify_proof(self, leaf: bytes, proof: List[Tuple[bytes, bool]]) -> bool:
-        current = self._hash_leaf(leaf)
+        return self._root_from_proof(self._hash_leaf(leaf), proof) == self.root
+    def _root_from_proof(self, current: bytes, proof: List[Tuple[bytes, bool]]) -> bytes:
         for sibling, is_left in proof:
             current = self._hash_node(sibling, current) if is_left else self._hash_node(current, sibling)
-        return current == self.root
+        return current
+    def get_multiproof(self, indices: List[int]) -> List[bytes]:
+        # 逐层只收集无法由已知节点推出的兄弟节点，按层、按下标升序排列
+        idxs = sorted(set(indices))
+        if idxs and not (0 <= idxs[0] and idxs[-1] < self.size):
+            raise IndexError("leaf index out of range")
+        proof = []
+        for layer in self.tree[:-1]:
+            known = set(idxs)
+            parents = []
+            for idx in idxs:
+                sibling_idx = idx ^ 1
+                if sibling_idx < len(layer) and sibling_idx not in known:
+                    proof.append(layer[sibling_idx])
+                if not parents or parents[-1] != idx >> 1:
+                    parents.append(idx >> 1)
+            idxs = parents
+        return proof
+    def _lone_parent(self, node: bytes) -> bytes:
+        return self._hash_node(node, node)
+    def verify_multiproof(self, leaves: List[bytes], indices: List[int], proof: List[bytes]) -> bool:
+        nodes = {}
+        for idx, leaf_hash in zip(indices, self._hash_leaves(leaves)):
+            if not 0 <= idx < self.size or nodes.setdefault(idx, leaf_hash) != leaf_hash:
+                return False
+        if not nodes or len(indices) != len(leaves):
+            return False
+        proof = iter(proof)
+        try:
+            for size in self.level_sizes(self.size)[:-1]:
+                parents, payloads, lone = [], [], {}
+                for idx in sorted(nodes):
+                    parent = idx >> 1
+                    if parents and parents[-1] == parent:
+                        continue
+                    parents.append(parent)
+                    if idx % 2 == 1:
+                        left, right = nodes.get(idx - 1) or next(proof), nodes[idx]
+                    elif idx + 1 < size:
+                        left, right = nodes[idx], nodes.get(idx + 1) or next(proof)
+                    else:
+                        lone[parent] = self._lone_parent(nodes[idx])
+                        continue
+                    payloads.append(b'\x01' + left + right)
+                hashed = iter(SM3.hash_many(payloads))
+                nodes = {parent: lone[parent] if parent in lone else next(hashed) for parent in parents}
+        except StopIteration:
+            return False
+        return next(proof, None) is None and nodes == {0: self.root}
+class IncrementalMerkleTree(MerkleTree):
+    # 增量模式采用 RFC 6962 的树形：某层末尾落单的节点原样提升到上一层，而不是与自身配对哈希。
+    # 这样追加叶子不会改变已有完整子树，每次 append/update 只需重算叶子到根的 O(log n) 条路径，
+    # 并且任意两个历史大小之间都可以给出一致性证明。每层单独存放在可增长的 bytearray 中。
+    MAGIC = b'SM3RFC01'
+    def __init__(self, data: List[bytes] = ()):
+        nodes = self._hash_leaves(list(data))
+        self._levels = [bytearray(b''.join(nodes))]
+        while len(nodes) > 1:
+            nodes = self._hash_level(nodes)
+            self._levels.append(bytearray(b''.join(nodes)))
+        self._refresh()
+    @staticmethod
+    def _hash_level(nodes: List[bytes]) -> List[bytes]:
+        hashed = SM3.hash_many(b'\x01' + nodes[i] + nodes[i+1] for i in range(0, len(nodes) - 1, 2))
+        if len(nodes) % 2:
+            hashed.append(nodes[-1])
+        return hashed
+    def _set_storage(self, buf, n: int, base: int = 0):
+        self._levels = []
+        offset = base
+        for size in self.level_sizes(n):
+            self._levels.append(bytearray(buf[offset:offset + size * 32]))
+            offset += size * 32
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+        self._refresh()
+    def _refresh(self):
+        self._buf = None
+        self.size = len(self._levels[0]) // 32
+        self.tree = [MerkleLevel(level, 0, len(level) // 32) for level in self._levels]
+        self.leaves = self.tree[0]
+        self.root = self.tree[-1][0] if self.size else b''
+    def _recompute_path(self, index: int):
+        idx = index
+        for depth in range(len(self._levels)):
+            level = self._levels[depth]
+            size = len(level) // 32
+            if size == 1:
+                del self._levels[depth + 1:]
+                break
+            if idx % 2 == 1:
+                parent = self._hash_node(level[(idx - 1) * 32:idx * 32], level[idx * 32:(idx + 1) * 32])
+            elif idx + 1 < size:
+                parent = self._hash_node(level[idx * 32:(idx + 1) * 32], level[(idx + 1) * 32:(idx + 2) * 32])
+            else:
+                parent = bytes(level[idx * 32:(idx + 1) * 32])
+            idx //= 2
+            if depth + 1 == len(self._levels):
+                self._levels.append(bytearray())
+            upper = self._levels[depth + 1]
+            if idx * 32 == len(upper):
+                upper += parent
+            else:
+                upper[idx * 32:(idx + 1) * 32] = parent
+        self._refresh()
+    def _lone_parent(self, node: bytes) -> bytes:
+        return node
+    def append(self, data: bytes) -> int:
+        index = self.size
+        self._levels[0] += self._hash_leaf(data)
+        self._recompute_path(index)
+        return index
+    def update(self, index: int, data: bytes):
+        if not 0 <= index < self.size:
+            raise IndexError("leaf index out of range")
+        self._levels[0][index * 32:(index + 1) * 32] = self._hash_leaf(data)
+        self._recompute_path(index)
+    def get_proof(self, index: int) -> List[Tuple[bytes, bool]]:
+        proof = []
+        idx = index
+        for layer in self.tree[:-1]:
+            sibling_idx = idx + 1 if idx % 2 == 0 else idx - 1
+            if sibling_idx < len(layer):
+                proof.append((layer[sibling_idx], idx % 2 == 1))
+            idx = idx // 2
+        return proof
+    def _range_hash(self, start: int, end: int) -> bytes:
+        # 计算叶子区间 [start, end) 的 MTH；start 按 2^ceil(log2(end-start)) 对齐
+        height = (end - start - 1).bit_length()
+        if end == self.size or end - start == 1 << height:
+            return self.tree[height][start >> height]
+        k = 1 << (height - 1)
+        return self._hash_node(self._range_hash(start, start + k), self._range_hash(start + k, end))
+    def root_at(self, size: int) -> bytes:
+        if not 0 < size <= self.size:
+            raise ValueError("tree size out of range")
+        return self._range_hash(0, size)
+    def get_consistency_proof(self, old_size: int) -> List[bytes]:
+        if not 0 <= old_size <= self.size:
+            raise ValueError("tree size out of range")
+        if old_size == 0:
+            return []
+        proof = []
+        start, end, complete = 0, self.size, True
+        while old_size != end:
+            k = 1 << (end - start - 1).bit_length() - 1
+            if old_size - start <= k:
+                proof.append(self._range_hash(start + k, end))
+                end = start + k
+            else:
+                proof.append(self._range_hash(start, start + k))
+                start += k
+                complete = False
+        if not complete:
+            proof.append(self._range_hash(start, end))
+        return proof[::-1]
+    @classmethod
+    def verify_consistency(cls, old_size: int, new_size: int, old_root: bytes, new_root: bytes, proof: List[bytes]) -> bool:
+        # RFC 9162 2.1.4.2
+        if old_size > new_size:
+            return False
+        if old_size == new_size:
+            return not proof and old_root == new_root
+        if old_size == 0:
+            return not proof
+        if not proof:
+            return False
+        if old_size & (old_size - 1) == 0:
+            proof = [old_root] + list(proof)
+        fn, sn = old_size - 1, new_size - 1
+        while fn & 1:
+            fn >>= 1
+            sn >>= 1
+        fr = sr = proof[0]
+        for c in proof[1:]:
+            if sn == 0:
+                return False
+            if fn & 1 or fn == sn:
+                fr = cls._hash_node(c, fr)
+                sr = cls._hash_node(c, sr)
+                while not fn & 1 and fn != 0:
+                    fn >>= 1
+                    sn >>= 1
+            else:
+                sr = cls._hash_node(sr, c)
+            fn >>= 1
+            sn >>= 1
+        return sn == 0 and fr == old_root and sr == new_root
+class SortedMerkleTree(MerkleTree):
+    # 叶子哈希去重后按字节序排列，第 0 层本身就是可二分查找的索引（打开的持久化文件同样适用）。
+    # 不存在性证明由目标哈希在排序中的前驱与后继两个相邻叶子及其路径组成，验证为 O(log n)。
+    MAGIC = b'SM3SRT01'
+    def __init__(self, data: List[bytes]):
+        self._set_storage(*self._build_packed(sorted(set(self._hash_leaves(list(data))))))
+    def find(self, data: bytes) -> int:
+        h = self._hash_leaf(data)
+        idx = bisect_left(self.leaves, h)
+        return idx if idx < self.size and self.leaves[idx] == h else -1
+    def get_non_membership_proof(self, data: bytes):
+        h = self._hash_leaf(data)
+        idx = bisect_left(self.leaves, h)
+        if idx < self.size and self.leaves[idx] == h:
+            raise ValueError("data is a member of the tree")
+        left = (self.leaves[idx - 1], self.get_proof(idx - 1)) if idx > 0 else None
+        right = (self.leaves[idx], self.get_proof(idx)) if idx < self.size else None
+        return left, right
+    def _proof_index(self, leaf_hash: bytes, proof: List[Tuple[bytes, bool]]) -> int:
+        # 路径必须完整到根，防止把中间节点冒充为叶子；下标由每层的左右位置还原
+        if len(proof) != len(self.tree) - 1 or self._root_from_proof(leaf_hash, proof) != self.root:
+            return -1
+        return sum(1 << level for level, (_, is_left) in enumerate(proof) if is_left)
+    def verify_non_membership(self, data: bytes, proof) -> bool:
+        h = self._hash_leaf(data)
+        left, right = proof
+        if left is None and right is None:
+            return self.size == 0
+        if left is not None:
+            left_idx = self._proof_index(*left)
+            if left_idx < 0 or not left[0] < h:
+                return False
+        if right is not None:
+            right_idx = self._proof_index(*right)
+            if right_idx < 0 or not h < right[0]:
+                return False
+        if left is None:
+            return right_idx == 0
+        if right is None:
+            return left_idx == self.size - 1
+        return right_idx == left_idx + 1
 if __name__ == "__main__":
     print("="*50)
     print("Task 1: SM3 Hash Test")
     print("="*50)
     test_msg = b"abc"
-    expected_hash = "66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7c2299a02"
+    expected_hash = "66c7f0f462eeedd9d1f2d46bdc10e4e24167c4875cf2f7a2297da02b8f4ba8e0"
     h = SM3.hash(test_msg)
     print(f"Input: {test_msg}")
     print(f"SM3 hash: {h.hex()}")
-    print(f"Expected: {expected_hash}...")
-    print(f"Test {'passed' if h.hex().startswith(expected_hash) else 'failed'}")
+    print(f"Expected: {expected_hash}")
+    print(f"Test {'passed' if h.hex() == expected_hash else 'failed'}")
+    streaming = SM3()
+    for i in range(len(test_msg)):
+        streaming.update(test_msg[i:i+1])
+    print(f"Streaming update()/digest(): {'passed' if streaming.digest() == h else 'failed'}")
+    compare_performance()
     length_extension_attack()
     print("\n" + "="*50)
     print("Task 3: Merkle Tree Test (10 leaves)")
@@ -132,6 +706,22 @@ if __name__ == "__main__":
     print(f"\nProof for leaf 3: {[(h.hex()[:8]+'...', pos) for h, pos in proof]}")
     valid = tree.verify_proof(b"3", proof)
     print(f"Verification: {valid}")
+    batch = [1, 3, 4, 8]
+    multiproof = tree.get_multiproof(batch)
+    print(f"Multiproof for leaves {batch}: {len(multiproof)} hashes (separate proofs: {sum(len(tree.get_proof(i)) for i in batch)})")
+    print(f"Batch verification: {tree.verify_multiproof([data[i] for i in batch], batch, multiproof)}")
     print("\nNon-membership test for '10':")
-    found = any(tree.verify_proof(b"10", tree.get_proof(i)) for i in range(10))
-    print(f"Leaf '10' {'exists' if found else 'does not exist'} in tree")
\ No newline at end of file
+    index = SortedMerkleTree(data)
+    absence = index.get_non_membership_proof(b"10")
+    print(f"Neighbours: {[(leaf.hex()[:8]+'...', len(path)) for leaf, path in filter(None, absence)]}")
+    print(f"Leaf '10' {'does not exist' if index.verify_non_membership(b'10', absence) else 'may exist'} in tree")
+    print("\n" + "="*50)
+    print("Task 4: Incremental Merkle Tree (RFC 6962 shape)")
+    print("="*50)
+    log = IncrementalMerkleTree(data[:7])
+    old_size, old_root = log.size, log.root
+    for i in range(7, 10):
+        log.append(data[i])
+    consistency = log.get_consistency_proof(old_size)
+    print(f"Root after append: {log.root.hex()}")
+    print(f"Consistency {old_size} -> {log.size}: {IncrementalMerkleTree.verify_consistency(old_size, log.size, old_root, log.root, consistency)}")
\ No newline at end of file
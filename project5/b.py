@@ -1,6 +1,19 @@
 from gmssl import sm2, sm3
+import os
+import sys
 import random
 import binascii
+from collections import deque
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Dict, List, Optional
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'project4'))
+from SM3 import SM3
+from a import SM2, Point, compute_za, DEFAULT_USER_ID
+N = 0xFFFFFFFEFFFFFFFFFFFFFFFFFFFFFFFF7203DF6B21C6052B53BBF40939D54123
+def recover_private_key(r1: int, s1: int, r2: int, s2: int, n: int = N) -> int:
+    # 同一 k：s_i(1 + d) = k - r_i·d，两式相减得 d = (s2 - s1) / (s1 - s2 + r1 - r2)
+    return (s2 - s1) * pow(s1 - s2 + r1 - r2, -1, n) % n
 class SM2_Misuse_POC:
     def __init__(self):
         self.private_key = self._generate_private_key()
@@ -10,7 +23,7 @@ class SM2_Misuse_POC:
             public_key=self.public_key,
             mode=1
         )
-        self.n = 0xFFFFFFFEFFFFFFFFFFFFFFFFFFFFFFFF7203DF6B21C6052B53BBF40939D54123
+        self.n = N
     def _generate_private_key(self) -> str:
         return binascii.b2a_hex(random.randbytes(32)).decode()
     def _get_public_key(self, private_key: str) -> str:
@@ -36,9 +49,138 @@ class SM2_Misuse_POC:
         hash2 = sm3.sm3_hash(list(msg2))
         e1 = int.from_bytes(bytes.fromhex(hash1), 'big') % self.n
         e2 = int.from_bytes(bytes.fromhex(hash2), 'big') % self.n
-        k = (e1 - e2) * pow(s1 - s2, -1, self.n) % self.n
-        private_key = (s1 * k - e1) * pow(r1, -1, self.n) % self.n
+        if (r1 - e1) % self.n != (r2 - e2) % self.n:
+            raise ValueError("signatures do not share a nonce")
+        private_key = recover_private_key(r1, s1, r2, s2, self.n)
         return f"{private_key:064x}"
+@lru_cache(maxsize=4096)
+def _za_for(key: bytes, user_id: bytes) -> bytes:
+    # key 为 32 字节时即 Z_A 本身；为 64/65 字节时是未压缩公钥 (04||)x||y，按 ID 计算 Z_A
+    if len(key) == 32:
+        return key
+    if len(key) == 65 and key[0] == 4:
+        key = key[1:]
+    if len(key) != 64:
+        raise ValueError("key must be a 32-byte Z_A or an uncompressed public key")
+    return compute_za(Point(int.from_bytes(key[:32], 'big'), int.from_bytes(key[32:], 'big')), user_id)
+def _parse_record(record: bytes, raw_message: bool = False):
+    # 标准记录 "key_hex,msg_hex,r_hex,s_hex[,id_hex]"，e = SM3(Z_A || M)，ID 缺省为 DEFAULT_USER_ID；
+    # raw_message 仅用于 POC 玩具签名器的 "msg_hex,r_hex,s_hex"，e = SM3(M)
+    fields = record.split(b',')
+    if raw_message:
+        if len(fields) != 3:
+            raise ValueError("expected msg_hex,r_hex,s_hex")
+        za = b''
+    else:
+        if len(fields) not in (4, 5):
+            raise ValueError("expected key_hex,msg_hex,r_hex,s_hex[,id_hex]")
+        user_id = bytes.fromhex(fields[4].decode()) if len(fields) == 5 else DEFAULT_USER_ID
+        za = _za_for(bytes.fromhex(fields[0].decode()), user_id)
+        fields = fields[1:4]
+    msg, r, s = fields
+    return za, bytes.fromhex(msg.decode()), int(r, 16), int(s, 16)
+def _parse_records(lines: List[bytes], raw_message: bool = False) -> List[Optional[tuple]]:
+    # 返回 (Z_A, x1, r, s)，x1 = (r - e) mod n，同一公钥下同一 k 的签名 x1 相同；格式错误的行为 None
+    parsed = []
+    for line in lines:
+        try:
+            parsed.append(_parse_record(line, raw_message))
+        except ValueError:
+            parsed.append(None)
+    digests = iter(SM3.hash_many(rec[0] + rec[1] for rec in parsed if rec))
+    records = []
+    for rec in parsed:
+        if rec is None:
+            records.append(None)
+        else:
+            za, _, r, s = rec
+            records.append((za, (r - int.from_bytes(next(digests), 'big')) % N, r, s))
+    return records
+def _nonce_commitments(lines: List[bytes], raw_message: bool = False) -> List[Optional[int]]:
+    # 索引键混入 Z_A，不同公钥的签名即使 x1 相同也不会被归为一组
+    return [None if rec is None else rec[1] ^ int.from_bytes(rec[0], 'big') for rec in _parse_records(lines, raw_message)]
+def _read_chunks(path, chunk_size: int):
+    offset = 0
+    offsets, lines = [], []
+    with open(path, 'rb') as f:
+        for line in f:
+            record = line.strip()
+            if record:
+                offsets.append(offset)
+                lines.append(record)
+                if len(lines) == chunk_size:
+                    yield offsets, lines
+                    offsets, lines = [], []
+            offset += len(line)
+    if lines:
+        yield offsets, lines
+class NonceReuseScanner:
+    # 单遍扫描签名语料：以 x1 的低 64 位为键建哈希表，只保存首条记录的文件偏移；
+    # 命中后回读原记录并比对完整 x1，仅对确认的碰撞组恢复私钥
+    KEY_MASK = (1 << 64) - 1
+    def __init__(self, processes: int = None, chunk_size: int = 10000, raw_message: bool = False):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.raw_message = raw_message
+        self.max_pending = 2 * (processes or os.cpu_count() or 1)
+        self.malformed = 0
+    def scan(self, path) -> List[dict]:
+        first: Dict[int, int] = {}
+        groups: Dict[int, List[int]] = {}
+        self.malformed = 0
+        def index(offsets, commitments):
+            for offset, x1 in zip(offsets, commitments):
+                if x1 is None:
+                    # 表头或损坏的行：计数后跳过，不中断扫描
+                    self.malformed += 1
+                    continue
+                key = x1 & self.KEY_MASK
+                seen = first.setdefault(key, offset)
+                if seen != offset:
+                    groups.setdefault(key, [seen]).append(offset)
+        with Pool(processes=self.processes) as pool:
+            # 在途任务数有上限，读取、哈希与建索引流水进行，内存不随语料大小增长（索引本身除外）
+            pending = deque()
+            for offsets, lines in _read_chunks(path, self.chunk_size):
+                pending.append((offsets, pool.apply_async(_nonce_commitments, (lines, self.raw_message))))
+                if len(pending) > self.max_pending:
+                    offsets, result = pending.popleft()
+                    index(offsets, result.get())
+            while pending:
+                offsets, result = pending.popleft()
+                index(offsets, result.get())
+        return [finding for finding in (self._exploit(path, offsets) for offsets in groups.values()) if finding]
+    def _exploit(self, path, offsets: List[int]):
+        with open(path, 'rb') as f:
+            records = []
+            for offset in offsets:
+                f.seek(offset)
+                records.append(f.readline().strip())
+        by_x1 = {}
+        for offset, rec in zip(offsets, _parse_records(records, self.raw_message)):
+            if rec is not None:
+                by_x1.setdefault(rec[:2], []).append((offset, rec[2:]))
+        for (_, x1), members in by_x1.items():
+            sigs = {}
+            for offset, sig in members:
+                sigs.setdefault(sig, offset)
+            if len(sigs) < 2:
+                continue
+            (r1, s1), (r2, s2) = list(sigs)[:2]
+            return {
+                'x1': f"{x1:064x}",
+                'offsets': [offset for offset, _ in members],
+                'private_key': f"{recover_private_key(r1, s1, r2, s2):064x}",
+            }
+        return None
+def write_signature_record(f, msg: bytes, signature: str, key: bytes = None, user_id: bytes = None):
+    # key 为公钥 (x||y) 或 Z_A；省略时写出 raw_message 格式，仅供玩具签名器使用
+    fields = [msg.hex(), signature[:64], signature[64:]]
+    if key is not None:
+        fields.insert(0, key.hex())
+        if user_id is not None:
+            fields.append(user_id.hex())
+    f.write((','.join(fields) + '\n').encode())
 if __name__ == "__main__":
     print("=== SM2签名误用攻击演示（重复k导致私钥泄露） ===")
     poc = SM2_Misuse_POC()
@@ -60,5 +202,23 @@ if __name__ == "__main__":
     e1 = int.from_bytes(bytes.fromhex(hash1), 'big') % poc.n
     r1 = int(sig1[:64], 16)
     s1 = int(sig1[64:], 16)
-    calculated_k = (s1 * (1 + d) + r1 * d - e1) % poc.n
-    print(f"计算出的k值: {hex(calculated_k)} (应与固定k值一致)")
\ No newline at end of file
+    calculated_k = (s1 * (1 + d) + r1 * d) % poc.n
+    print(f"计算出的k值: {hex(calculated_k)} (应与固定k值一致)")
+    print("\n=== 签名语料中的重复k扫描 ===")
+    signer = SM2()
+    public_key = signer.public_key.x.to_bytes(32, 'big') + signer.public_key.y.to_bytes(32, 'big')
+    corpus = "signatures.csv"
+    with open(corpus, 'wb') as f:
+        f.write(b"key_hex,msg_hex,r_hex,s_hex\n")
+        for i in range(1000):
+            msg = f"record {i}".encode()
+            write_signature_record(f, msg, "%064x%064x" % signer.sign(msg), public_key)
+        for msg in (msg1, msg2):
+            write_signature_record(f, msg, "%064x%064x" % signer.sign(msg, k_value), public_key)
+    scanner = NonceReuseScanner()
+    findings = scanner.scan(corpus)
+    print(f"跳过格式错误的记录: {scanner.malformed} 条")
+    for finding in findings:
+        print(f"碰撞记录偏移: {finding['offsets']}")
+        print(f"恢复的私钥: {finding['private_key']} (正确: {int(finding['private_key'], 16) == signer.private_key})")
+    os.remove(corpus)
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+from typing import List
+from a import SM2, SM2BatchVerifier, PERFORMANCE_MODES
+def percentile(samples: List[int], q: float) -> float:
+    # 线性插值百分位，samples 需已排序
+    if not samples:
+        return float('nan')
+    pos = (len(samples) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+def summarize(samples_ns: List[int], ops_per_sample: int = 1) -> dict:
+    samples = sorted(samples_ns)
+    total = sum(samples)
+    return {
+        'samples': len(samples),
+        'mean_ms': total / len(samples) / 1e6,
+        'p50_ms': percentile(samples, 50) / 1e6,
+        'p95_ms': percentile(samples, 95) / 1e6,
+        'p99_ms': percentile(samples, 99) / 1e6,
+        'ops_per_sec': len(samples) * ops_per_sample / (total / 1e9) if total else float('inf'),
+    }
+def time_calls(func, inputs, warmup: int) -> List[int]:
+    for args in inputs[:warmup]:
+        func(*args)
+    samples = []
+    for args in inputs:
+        start = time.perf_counter_ns()
+        func(*args)
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+def random_messages(count: int, size: int) -> List[bytes]:
+    return [random.randbytes(size) for _ in range(count)]
+def bench_mode(options: dict, iterations: int, warmup: int, message_sizes: List[int],
+               batch_sizes: List[int], batch_rounds: int, processes: int, chunk_sizes: List[int] = None) -> dict:
+    results = {}
+    results['keygen'] = summarize(time_calls(lambda: SM2(**options), [()] * iterations, warmup))
+    sm2 = SM2(**options)
+    # 待验证的签名与模式无关，用优化实现预先生成，避免基础模式的准备时间过长
+    signer = SM2(private_key=sm2.private_key)
+    public_key = (sm2.public_key.x, sm2.public_key.y)
+    for size in message_sizes:
+        messages = random_messages(iterations, size)
+        results[f'sign/{size}B'] = summarize(time_calls(sm2.sign, [(m,) for m in messages], warmup))
+        signed = [(m, signer.sign(m)) for m in messages]
+        results[f'verify/{size}B'] = summarize(time_calls(sm2.verify, signed, warmup))
+    with SM2BatchVerifier(processes=processes, **options) as verifier:
+        list(verifier.verify_many([(m, sig, public_key) for m, sig in signed[:processes * 2]]))
+        for batch_size in batch_sizes:
+            # 默认每个进程恰好分到一块；给出 chunk_sizes 时逐个扫描，结果键带上块大小
+            for chunk_size in chunk_sizes or [max(1, batch_size // (processes or 1))]:
+                verifier.chunk_size = chunk_size
+                samples = []
+                for _ in range(batch_rounds):
+                    messages = random_messages(batch_size, message_sizes[0])
+                    items = [(m, signer.sign(m), public_key) for m in messages]
+                    start = time.perf_counter_ns()
+                    ok = all(verifier.verify_many(items))
+                    samples.append(time.perf_counter_ns() - start)
+                    if not ok:
+                        raise RuntimeError("batch verification rejected a valid signature")
+                name = f'batch_verify/{batch_size}' + (f'/chunk{chunk_size}' if chunk_sizes else '')
+                results[name] = dict(summarize(samples, batch_size), chunk_size=chunk_size)
+    return results
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SM2 keygen/sign/verify benchmark")
+    parser.add_argument('--modes', nargs='+', default=[mode for mode, _, _ in PERFORMANCE_MODES],
+                        choices=[mode for mode, _, _ in PERFORMANCE_MODES])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--message-sizes', type=int, nargs='+', default=[32, 256, 4096])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64, 256])
+    parser.add_argument('--batch-rounds', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=None,
+                        help="批量验证的分块大小，默认 batch_size // processes")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='sm2_benchmark.json')
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args),
+        'modes': {},
+    }
+    for mode, label, options in PERFORMANCE_MODES:
+        if mode not in args.modes:
+            continue
+        print(f"\n{'='*30}")
+        print(f"测试模式: {label}")
+        results = bench_mode(options, args.iterations, args.warmup, args.message_sizes,
+                             args.batch_sizes, args.batch_rounds, args.processes, args.chunk_sizes)
+        report['modes'][mode] = results
+        print(f"{'操作':<20} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9} | {'ops/s':>9}")
+        print("-" * 68)
+        for name, stats in results.items():
+            print(f"{name:<20} | {stats['p50_ms']:>9.3f} | {stats['p95_ms']:>9.3f} | {stats['p99_ms']:>9.3f} | {stats['ops_per_sec']:>9.1f}")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n结果已写入 {args.output}")
+    return report
+if __name__ == "__main__":
+    main()
\ No newline at end of file
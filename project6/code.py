@@ -1,7 +1,13 @@
+import os
 import hashlib
 import random
-from typing import List, Tuple
-def generate_large_prime(bits):
+import threading
+from collections import deque
+from itertools import islice
+from math import gcd
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List, Tuple
+def generate_large_prime(bits, rng=random):
     def is_prime(n):
         if n < 2: return False
         for p in [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37]:
@@ -22,56 +28,241 @@ def generate_large_prime(bits):
                 return False
         return True
     while True:
-        p = random.getrandbits(bits)
+        # 固定最高位与最低位：结果恰为 bits 位的奇数
+        p = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
         if p > 2 and is_prime(p):
             return p
 class SimpleHomomorphicEncryption:
     def __init__(self, key_size=64):
         self.p = generate_large_prime(key_size)
         self.g = self.p + 1
+        self.p2 = self.p ** 2
+        # g = p + 1 时 L(g^(p-1)) 为常数，其逆只需计算一次
+        self.mu = pow((pow(self.g, self.p-1, self.p2) - 1) // self.p, -1, self.p)
     def encrypt(self, m):
         r = random.randint(1, self.p-1)
-        return (pow(self.g, m, self.p**2) * pow(r, self.p, self.p**2)) % self.p**2
+        return (1 + m * self.p) * pow(r, self.p, self.p2) % self.p2  # g^m = 1 + m·p (mod p²)
     def decrypt(self, c):
-        L = lambda x: (x - 1) // self.p
-        return (L(pow(c, self.p-1, self.p**2)) * pow(L(pow(self.g, self.p-1, self.p**2)), -1, self.p) % self.p)
+        return (pow(c, self.p-1, self.p2) - 1) // self.p * self.mu % self.p
     def add(self, c1, c2):
-        return (c1 * c2) % self.p**2
+        return (c1 * c2) % self.p2
     def add_scalar(self, c, s):
-        return (c * pow(self.g, s, self.p**2)) % self.p**2
+        return c * (1 + s * self.p) % self.p2
+    def close(self):
+        pass
+class RandomnessPool:
+    # 预先计算 Paillier 盲化因子 r^n mod n²，后台线程在存量低于 low_water 时补满
+    def __init__(self, generate, size=256, low_water=None, background=True):
+        self.generate = generate
+        self.size = size
+        self.low_water = size // 2 if low_water is None else low_water
+        self._items = deque()
+        self._wanted = threading.Event()
+        self._closed = False
+        self._thread = None
+        if background and size:
+            self._thread = threading.Thread(target=self._refill, daemon=True)
+            self._thread.start()
+            self._wanted.set()
+    def _refill(self):
+        # 每轮结束后重新检查 _closed：close() 若发生在补池途中，其 set() 会被 clear() 吞掉
+        while not self._closed:
+            self._wanted.wait()
+            while len(self._items) < self.size and not self._closed:
+                self._items.append(self.generate())
+            self._wanted.clear()
+    def fill(self):
+        while len(self._items) < self.size:
+            self._items.append(self.generate())
+    def get(self):
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            item = self.generate()  # 池空时就地计算，不阻塞调用方
+        if len(self._items) < self.low_water:
+            self._wanted.set()
+        return item
+    def __len__(self):
+        return len(self._items)
+    def close(self):
+        self._closed = True
+        self._wanted.set()
+class PaillierPublicKey:
+    # 只持有公钥 n 的一方：可以加密、密文相加、加常数，不能解密
+    def __init__(self, n, rng=None):
+        self.rng = rng or random.SystemRandom()
+        self.n = n
+        self.n2 = n * n
+        self.g = n + 1
+    def _blinding_factor(self):
+        while True:
+            r = self.rng.randrange(1, self.n)
+            if gcd(r, self.n) == 1:
+                return pow(r, self.n, self.n2)
+    def encrypt(self, m):
+        return (1 + m % self.n * self.n) * self._blinding_factor() % self.n2
+    def add(self, c1, c2):
+        return c1 * c2 % self.n2
+    def add_scalar(self, c, s):
+        return c * (1 + s % self.n * self.n) % self.n2
+class PaillierEngine(PaillierPublicKey):
+    # n = p·q，g = n + 1：加密 c = (1 + m·n)·r^n mod n²，r^n 取自预计算池；解密按 p²、q² 做 CRT
+    def __init__(self, key_size=2048, pool_size=256, background=True, rng=None):
+        rng = rng or random.SystemRandom()
+        while True:
+            p = generate_large_prime(key_size // 2, rng)
+            q = generate_large_prime(key_size - key_size // 2, rng)
+            if p != q and (p * q).bit_length() == key_size and gcd(p * q, (p - 1) * (q - 1)) == 1:
+                break
+        super().__init__(p * q, rng)
+        self.p, self.q = p, q
+        self.p2, self.q2 = p * p, q * q
+        # 解密常数：h_p = L_p(g^(p-1) mod p²)^(-1) mod p，h_q 同理，以及 CRT 系数
+        self.hp = pow((pow(self.g, p - 1, self.p2) - 1) // p, -1, p)
+        self.hq = pow((pow(self.g, q - 1, self.q2) - 1) // q, -1, q)
+        self.q_inv = pow(q, -1, p)
+        # r^n mod p² 的指数可约化到群阶 p(p-1)
+        self.n_mod_p2 = self.n % (p * (p - 1))
+        self.n_mod_q2 = self.n % (q * (q - 1))
+        self.p2_inv = pow(self.p2, -1, self.q2)
+        self.pool = RandomnessPool(self._blinding_factor, pool_size, background=background)
+    def _blinding_factor(self):
+        while True:
+            r = self.rng.randrange(1, self.n)
+            if gcd(r, self.n) == 1:
+                break
+        # 持有私钥时按 p²、q² 分别求幂再 CRT 合并，两次半长模幂明显快于直接模 n² 求幂
+        xp = pow(r % self.p2, self.n_mod_p2, self.p2)
+        xq = pow(r % self.q2, self.n_mod_q2, self.q2)
+        return xp + self.p2 * ((xq - xp) * self.p2_inv % self.q2)
+    def encrypt(self, m):
+        return (1 + m % self.n * self.n) * self.pool.get() % self.n2
+    def decrypt(self, c):
+        p, q = self.p, self.q
+        mp = (pow(c % self.p2, p - 1, self.p2) - 1) // p * self.hp % p
+        mq = (pow(c % self.q2, q - 1, self.q2) - 1) // q * self.hq % q
+        return mq + q * ((mp - mq) * self.q_inv % p)
+    def public_key(self):
+        return PaillierPublicKey(self.n)
+    def close(self):
+        self.pool.close()
+def _hash_exponent(x, order):
+    return int.from_bytes(hashlib.sha256(x.encode()).digest(), 'big') % order
+def _hash_blind_chunk(items, g, k, p):
+    # H(x)^k = g^(h(x)·k mod (p-1))：哈希到群与盲化合并为一次模幂
+    return [pow(g, _hash_exponent(x, p - 1) * k % (p - 1), p) for x in items]
+def _pow_chunk(elements, k, p):
+    return [pow(h, k, p) for h in elements]
+def _chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+def _firsts(chunk):
+    return [first for first, _ in chunk]
+class ExponentiationPool:
+    # 按块把模幂分发到进程池；在途块数有上限，输入按需读取，结果按输入顺序流式产出
+    def __init__(self, processes=None, chunk_size=4096, max_pending=None):
+        self.processes = os.cpu_count() if processes is None else processes
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * max(self.processes, 1)
+        self._pool = Pool(self.processes) if self.processes > 1 else None
+    def map(self, func, chunks, *args, key=None) -> Iterator[Tuple[list, list]]:
+        # key 从每块中取出需要计算的部分，原块随结果一起返回
+        if self._pool is None:
+            for chunk in chunks:
+                yield chunk, func(key(chunk) if key else chunk, *args)
+            return
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, self._pool.apply_async(func, (key(chunk) if key else chunk,) + args)))
+            if len(pending) > self.max_pending:
+                chunk, result = pending.popleft()
+                yield chunk, result.get()
+        while pending:
+            chunk, result = pending.popleft()
+            yield chunk, result.get()
+    def hash_blind(self, items: Iterable[str], g, k, p) -> Iterator[int]:
+        for _, result in self.map(_hash_blind_chunk, _chunked(items, self.chunk_size), g, k, p):
+            yield from result
+    def blind(self, elements: Iterable[int], k, p) -> Iterator[int]:
+        for _, result in self.map(_pow_chunk, _chunked(elements, self.chunk_size), k, p):
+            yield from result
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+class Party1:
+    # P1：持有 ID 集合 {v_i}
+    def __init__(self, protocol, items: Iterable[str], pool: ExponentiationPool):
+        self.protocol = protocol
+        self.items = items
+        self.pool = pool
+        self.k1 = random.randint(1, protocol.p-2)
+    def round1(self) -> Iterator[int]:
+        # 发送 H(v_i)^k1
+        return self.pool.hash_blind(self.items, self.protocol.g, self.k1, self.protocol.p)
+    def round3(self, double_blinded: Iterable[int], pairs: Iterable[Tuple[int, int]], ahe):
+        # 收到 {H(v_i)^(k1k2)} 与打乱的 (H(w_j)^k2, Enc(t_j))，对后者再盲化后匹配并同态求和
+        target = set(double_blinded)
+        sum_ct = ahe.encrypt(0)
+        size = 0
+        for chunk, hashes in self.pool.map(_pow_chunk, _chunked(pairs, self.pool.chunk_size),
+                                           self.k1, self.protocol.p, key=_firsts):
+            for h, (_, ct) in zip(hashes, chunk):
+                if h in target:
+                    sum_ct = ahe.add(sum_ct, ct)
+                    size += 1
+        self.mask = random.randint(0, 1000)
+        return size, ahe.add_scalar(sum_ct, self.mask)
+    def unmask(self, masked_sum):
+        return masked_sum - self.mask
+class Party2:
+    # P2：持有 (w_j, t_j) 与同态加密私钥
+    def __init__(self, protocol, data: Iterable[Tuple[str, int]], ahe, pool: ExponentiationPool):
+        self.protocol = protocol
+        self.data = data
+        self.ahe = ahe
+        self.pool = pool
+        self.k2 = random.randint(1, protocol.p-2)
+    def round2(self, p1_blinded: Iterable[int]):
+        # 打乱顺序需要完整的列表，这一步无法流式
+        p = self.protocol.p
+        double_blinded = list(self.pool.blind(p1_blinded, self.k2, p))
+        random.shuffle(double_blinded)
+        pairs = []
+        for chunk, hashes in self.pool.map(_hash_blind_chunk, _chunked(self.data, self.pool.chunk_size),
+                                           self.protocol.g, self.k2, p, key=_firsts):
+            pairs.extend((h, self.ahe.encrypt(t)) for h, (_, t) in zip(hashes, chunk))
+        random.shuffle(pairs)
+        return double_blinded, pairs
+    def decrypt_sum(self, sum_ct):
+        return self.ahe.decrypt(sum_ct)
 class PrivateIntersectionSum:
-    def __init__(self, group_size=128):
+    def __init__(self, group_size=128, ahe_factory=SimpleHomomorphicEncryption):
         self.p = generate_large_prime(group_size)
         self.g = 2
+        self.ahe_factory = ahe_factory
     def _hash_to_group(self, x):
-        h = hashlib.sha256(x.encode()).digest()
-        return pow(self.g, int.from_bytes(h, 'big') % (self.p-1), self.p)
-    def execute_protocol(self, party1_items, party2_data):
-        k1 = random.randint(1, self.p-2)
-        hashed_p1 = [self._hash_to_group(v) for v in party1_items]
-        p1_to_p2 = [pow(h, k1, self.p) for h in hashed_p1]
-        ahe = SimpleHomomorphicEncryption()
-        k2 = random.randint(1, self.p-2)
-        hashed_p2 = [self._hash_to_group(w) for w, _ in party2_data]
-        p2_hashed = [pow(h, k2, self.p) for h in hashed_p2]
-        p2_encrypted = [ahe.encrypt(t) for _, t in party2_data]
-        combined = list(zip(p2_hashed, p2_encrypted))
-        random.shuffle(combined)
-        shuffled_hashes, shuffled_enc = zip(*combined)
-        p1_hashed = [pow(h, k1, self.p) for h in shuffled_hashes]
-        masks = [random.randint(0, 1000) for _ in shuffled_enc]
-        masked_enc = [ahe.add_scalar(enc, m) for enc, m in zip(shuffled_enc, masks)]
-        p1_final_hashes = [pow(pow(self._hash_to_group(v), k1, self.p), k2, self.p) 
-                          for v in party1_items]
-        intersection = set(p1_hashed) & set(p1_final_hashes)
-        sum_ct = ahe.encrypt(0)
-        for h, enc in zip(p1_hashed, masked_enc):
-            if h in intersection:
-                sum_ct = ahe.add(sum_ct, enc)
-        masked_sum = ahe.decrypt(sum_ct)
-        total_mask = sum(m for h, m in zip(p1_hashed, masks) if h in intersection)
-        true_sum = masked_sum - total_mask
-        return len(intersection), true_sum
+        return pow(self.g, _hash_exponent(x, self.p-1), self.p)
+    def execute_protocol(self, party1_items, party2_data, processes=None, chunk_size=4096):
+        with ExponentiationPool(processes, chunk_size) as pool:
+            ahe = self.ahe_factory()
+            try:
+                party1 = Party1(self, party1_items, pool)
+                party2 = Party2(self, party2_data, ahe, pool)
+                double_blinded, pairs = party2.round2(party1.round1())
+                size, sum_ct = party1.round3(double_blinded, pairs, ahe)
+                return size, party1.unmask(party2.decrypt_sum(sum_ct))
+            finally:
+                # PaillierEngine 的补池线程持有私钥，协议结束即关闭
+                ahe.close()
 if __name__ == "__main__":
     protocol = PrivateIntersectionSum()
     party1_data = ["user1", "user2", "user3", "user5"]
@@ -79,4 +270,23 @@ if __name__ == "__main__":
     size, total = protocol.execute_protocol(party1_data, party2_data)
     print(f"交集大小: {size}")
     print(f"关联值总和: {total}")
-    print("实际交集:", set(party1_data) & set(w[0] for w in party2_data))
\ No newline at end of file
+    print("实际交集:", set(party1_data) & set(w[0] for w in party2_data))
+    print("\n=== Paillier 引擎（2048 位 n = p·q，CRT 解密，r^n 预计算池） ===")
+    import time
+    engine = PaillierEngine(2048, pool_size=64, background=False)
+    engine.pool.fill()
+    values = list(range(32))
+    start = time.perf_counter()
+    cts = [engine.encrypt(v) for v in values]
+    enc_ms = (time.perf_counter() - start) / len(values) * 1e3
+    total_ct = engine.encrypt(0)
+    for ct in cts:
+        total_ct = engine.add(total_ct, ct)
+    start = time.perf_counter()
+    total = engine.decrypt(total_ct)
+    dec_ms = (time.perf_counter() - start) * 1e3
+    print(f"同态求和: {total} (应为 {sum(values)})")
+    print(f"加密(池命中): {enc_ms:.3f} ms/次, CRT解密: {dec_ms:.1f} ms")
+    engine.close()
+    size, total = PrivateIntersectionSum(ahe_factory=lambda: PaillierEngine(1024, pool_size=16)).execute_protocol(party1_data, party2_data)
+    print(f"使用 PaillierEngine 的协议结果: 交集大小 {size}, 关联值总和 {total}")
\ No newline at end of file
@@ -0,0 +1,318 @@
+import time
+import random
+import struct
+import asyncio
+import argparse
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Event, Process
+from typing import Iterable, Tuple
+from code import PaillierEngine, PaillierPublicKey, generate_large_prime, _hash_blind_chunk, _pow_chunk, _chunked, _firsts
+# 帧格式：消息类型(1B) | 记录数(4B) | 每条记录字节数(4B) | 定长记录 × 记录数；记录数为 0 的帧表示该阶段数据结束
+HEADER = struct.Struct('>BII')
+HELLO, BLINDED, DOUBLE_BLINDED, PAIRS, SUM, MASKED_SUM, RESULT = range(1, 8)
+HELLO_WIDTH = 512  # 握手中 p、g、n 的编码宽度，支持到 4096 位
+class LinkStats:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.round_trips = 0
+        self.stages = {}
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+    def report(self):
+        return {
+            'bytes_sent': self.bytes_sent, 'bytes_received': self.bytes_received,
+            'frames_sent': self.frames_sent, 'frames_received': self.frames_received,
+            'round_trips': self.round_trips,
+            'stages_ms': {name: seconds * 1e3 for name, seconds in self.stages.items()},
+        }
+class Channel:
+    # 记录按列定宽编码：widths 给出每列的字节数，大整数按大端序写入
+    def __init__(self, reader, writer, stats: LinkStats = None):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats or LinkStats()
+        self._sending = False
+    async def send(self, kind, rows, widths):
+        payload = b''.join(b''.join(v.to_bytes(w, 'big') for v, w in zip(row, widths)) for row in rows)
+        frame = HEADER.pack(kind, len(rows), sum(widths)) + payload
+        self.writer.write(frame)
+        await self.writer.drain()
+        self.stats.bytes_sent += len(frame)
+        self.stats.frames_sent += 1
+        self._sending = True
+    async def recv(self, expected, widths):
+        kind, count, width = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+        if kind != expected:
+            raise ConnectionError(f"unexpected frame type {kind}, expected {expected}")
+        if count and width != sum(widths):
+            raise ConnectionError(f"record width {width} does not match {sum(widths)}")
+        payload = await self.reader.readexactly(count * width)
+        self.stats.bytes_received += HEADER.size + len(payload)
+        self.stats.frames_received += 1
+        # 先发后收计为一次往返
+        if self._sending:
+            self.stats.round_trips += 1
+            self._sending = False
+        rows, offset = [], 0
+        for _ in range(count):
+            row = []
+            for w in widths:
+                row.append(int.from_bytes(payload[offset:offset + w], 'big'))
+                offset += w
+            rows.append(row)
+        return rows
+    async def send_stream(self, kind, rows, widths, batch_size):
+        for i in range(0, len(rows), batch_size):
+            await self.send(kind, rows[i:i + batch_size], widths)
+        await self.send(kind, [], widths)
+    async def recv_stream(self, kind, widths):
+        while True:
+            rows = await self.recv(kind, widths)
+            if not rows:
+                return
+            yield rows
+def _executor(processes):
+    # 进程池真正并行；processes <= 1 时放到单个线程里，至少不阻塞事件循环的收发
+    return ProcessPoolExecutor(processes) if processes > 1 else ThreadPoolExecutor(1)
+async def _pipelined(executor, max_pending, func, chunks, args, key=None):
+    # 有界的在途任务队列：计算与收发重叠，结果按提交顺序产出
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    async for chunk in _aiter(chunks):
+        pending.append((chunk, loop.run_in_executor(executor, func, key(chunk) if key else chunk, *args)))
+        if len(pending) > max_pending:
+            chunk, future = pending.popleft()
+            yield chunk, await future
+    while pending:
+        chunk, future = pending.popleft()
+        yield chunk, await future
+async def _aiter(chunks):
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+def _first_column(rows):
+    return [row[0] for row in rows]
+def _widths(p, n):
+    return (p.bit_length() + 7) // 8, (2 * n.bit_length() + 7) // 8
+class Party1:
+    # 客户端：持有 ID 集合，结束时得到交集大小与关联值总和
+    def __init__(self, items: Iterable[str], batch_size=1024, processes=1, max_pending=4):
+        self.items = items
+        self.batch_size = batch_size
+        self.processes = processes
+        self.max_pending = max_pending
+        self.stats = LinkStats()
+    async def run(self, reader, writer):
+        ch = Channel(reader, writer, self.stats)
+        with _executor(self.processes) as executor:
+            with self.stats.stage('handshake'):
+                (p, g, n), = await ch.recv(HELLO, (HELLO_WIDTH,) * 3)
+                elem_w, ct_w = _widths(p, n)
+                ahe = PaillierPublicKey(n)
+                k1 = random.randint(1, p-2)
+            with self.stats.stage('round1_send_blinded'):
+                # 流式读取 ID，算好一批 H(v)^k1 就发一批
+                async for _, blinded in _pipelined(executor, self.max_pending, _hash_blind_chunk,
+                                                   _chunked(self.items, self.batch_size), (g, k1, p)):
+                    await ch.send(BLINDED, [(h,) for h in blinded], (elem_w,))
+                await ch.send(BLINDED, [], (elem_w,))
+            with self.stats.stage('round2_recv_double_blinded'):
+                target = set()
+                async for rows in ch.recv_stream(DOUBLE_BLINDED, (elem_w,)):
+                    target.update(h for h, in rows)
+            with self.stats.stage('round3_match_and_sum'):
+                # 边收 (H(w)^k2, Enc(t)) 边再盲化匹配
+                sum_ct = ahe.encrypt(0)
+                size = 0
+                async for rows, hashes in _pipelined(executor, self.max_pending, _pow_chunk,
+                                                     ch.recv_stream(PAIRS, (elem_w, ct_w)), (k1, p), key=_first_column):
+                    for h, (_, ct) in zip(hashes, rows):
+                        if h in target:
+                            sum_ct = ahe.add(sum_ct, ct)
+                            size += 1
+                mask = random.randint(0, 1000)
+            with self.stats.stage('decrypt_round_trip'):
+                await ch.send(SUM, [(ahe.add_scalar(sum_ct, mask),)], (ct_w,))
+                (masked_sum,), = await ch.recv(MASKED_SUM, (ct_w,))
+                total = masked_sum - mask
+                await ch.send(RESULT, [(size, total)], (8, ct_w))
+        writer.close()
+        await writer.wait_closed()
+        return size, total
+class Party2:
+    # 服务端：持有 (ID, 数值) 与 Paillier 私钥
+    def __init__(self, data: Iterable[Tuple[str, int]], key_size=2048, group_size=128, batch_size=1024,
+                 processes=1, max_pending=4):
+        self.data = data
+        self.p = generate_large_prime(group_size)
+        self.g = 2
+        self.ahe = PaillierEngine(key_size, pool_size=batch_size)
+        self.batch_size = batch_size
+        self.processes = processes
+        self.max_pending = max_pending
+        self.stats = LinkStats()
+    async def _prepare_pairs(self, executor, k2):
+        pairs = []
+        async for chunk, hashes in _pipelined(executor, self.max_pending, _hash_blind_chunk,
+                                              _chunked(self.data, self.batch_size), (self.g, k2, self.p), key=_firsts):
+            # 加密放到默认线程池里，池未命中时的 r^n 计算不会卡住对 P1 数据的接收
+            cts = await asyncio.get_running_loop().run_in_executor(None, self._encrypt_chunk, chunk)
+            pairs.extend(zip(hashes, cts))
+        random.shuffle(pairs)
+        return pairs
+    def _encrypt_chunk(self, chunk):
+        return [self.ahe.encrypt(t) for _, t in chunk]
+    async def handle(self, reader, writer):
+        ch = Channel(reader, writer, self.stats)
+        p, n = self.p, self.ahe.n
+        elem_w, ct_w = _widths(p, n)
+        with _executor(self.processes) as executor:
+            with self.stats.stage('handshake'):
+                await ch.send(HELLO, [(p, self.g, n)], (HELLO_WIDTH,) * 3)
+                k2 = random.randint(1, p-2)
+            # 本方 (H(w)^k2, Enc(t)) 与对方数据无关，接收 P1 数据的同时在后台准备
+            pairs_task = asyncio.create_task(self._prepare_pairs(executor, k2))
+            with self.stats.stage('round2_double_blind'):
+                double_blinded = []
+                async for rows, blinded in _pipelined(executor, self.max_pending, _pow_chunk,
+                                                      ch.recv_stream(BLINDED, (elem_w,)), (k2, p), key=_first_column):
+                    double_blinded.extend((h,) for h in blinded)
+                random.shuffle(double_blinded)
+            with self.stats.stage('round2_send_double_blinded'):
+                await ch.send_stream(DOUBLE_BLINDED, double_blinded, (elem_w,), self.batch_size)
+            with self.stats.stage('round2_send_pairs'):
+                pairs = await pairs_task
+                await ch.send_stream(PAIRS, pairs, (elem_w, ct_w), self.batch_size)
+            with self.stats.stage('decrypt_sum'):
+                (sum_ct,), = await ch.recv(SUM, (ct_w,))
+                await ch.send(MASKED_SUM, [(self.ahe.decrypt(sum_ct),)], (ct_w,))
+                (size, total), = await ch.recv(RESULT, (8, ct_w))
+        writer.close()
+        await writer.wait_closed()
+        self.ahe.close()
+        return size, total
+def parse_address(address):
+    # "unix:/path/to/sock" 或 "host:port"
+    if address.startswith('unix:'):
+        return 'unix', address[5:]
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+async def serve_party2(party: Party2, address, ready=None):
+    # ready（multiprocessing.Event）在开始监听后置位，P1 据此连接，不必猜测密钥生成要多久
+    kind, target = parse_address(address)
+    done = asyncio.get_running_loop().create_future()
+    async def on_connect(reader, writer):
+        try:
+            done.set_result(await party.handle(reader, writer))
+        except Exception as e:
+            done.set_exception(e)
+    if kind == 'unix':
+        server = await asyncio.start_unix_server(on_connect, target)
+    else:
+        server = await asyncio.start_server(on_connect, *target)
+    async with server:
+        if ready is not None:
+            ready.set()
+        return await done
+async def connect_party1(party: Party1, address, timeout=30.0):
+    # P2 启动时要先生成 Paillier 密钥和群素数，在 timeout 秒内反复重试连接
+    kind, target = parse_address(address)
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        try:
+            if kind == 'unix':
+                reader, writer = await asyncio.open_unix_connection(target)
+            else:
+                reader, writer = await asyncio.open_connection(*target)
+            break
+        except (ConnectionRefusedError, FileNotFoundError):
+            if asyncio.get_running_loop().time() >= deadline:
+                raise
+            await asyncio.sleep(0.1)
+    return await party.run(reader, writer)
+def read_items(path):
+    with open(path) as f:
+        for line in f:
+            item = line.strip()
+            if item:
+                yield item
+def read_pairs(path):
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item, value = line.strip().rsplit(',', 1)
+                pairs.append((item, int(value)))
+    return pairs
+def print_report(name, result, stats: LinkStats):
+    report = stats.report()
+    print(f"\n[{name}] 交集大小: {result[0]}, 关联值总和: {result[1]}")
+    print(f"[{name}] 发送 {report['bytes_sent']} 字节 / {report['frames_sent']} 帧, "
+          f"接收 {report['bytes_received']} 字节 / {report['frames_received']} 帧, 往返 {report['round_trips']} 次")
+    for stage, ms in report['stages_ms'].items():
+        print(f"[{name}]   {stage:<28} {ms:>10.1f} ms")
+def run_party2(args, data=None, ready=None):
+    party = Party2(data if data is not None else read_pairs(args.data), args.key_size, args.group_size,
+                   args.batch_size, args.processes, args.max_pending)
+    result = asyncio.run(serve_party2(party, args.address, ready))
+    print_report('P2', result, party.stats)
+    return result
+def run_party1(args, items=None):
+    party = Party1(items if items is not None else read_items(args.items), args.batch_size, args.processes,
+                   args.max_pending)
+    result = asyncio.run(connect_party1(party, args.address, args.connect_timeout))
+    print_report('P1', result, party.stats)
+    return result
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基于 asyncio 的两方 PSI-Sum（P1/P2 分别运行）")
+    parser.add_argument('role', choices=['party1', 'party2', 'demo'])
+    parser.add_argument('--address', default='127.0.0.1:9555', help="host:port 或 unix:/path/to/sock")
+    parser.add_argument('--items', help="P1 的 ID 文件，每行一个")
+    parser.add_argument('--data', help="P2 的数据文件，每行 id,value")
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--max-pending', type=int, default=4)
+    parser.add_argument('--key-size', type=int, default=2048)
+    parser.add_argument('--group-size', type=int, default=128)
+    parser.add_argument('--connect-timeout', type=float, default=30.0, help="P1 等待 P2 开始监听的秒数")
+    parser.add_argument('--demo-size', type=int, default=300)
+    args = parser.parse_args(argv)
+    if args.role == 'party1':
+        return run_party1(args)
+    if args.role == 'party2':
+        return run_party2(args)
+    # 演示：P2 在子进程中监听，P1 等它就绪后在本进程连接；出错时不留下孤儿进程
+    size = args.demo_size
+    items = [f"user{i}" for i in range(size)]
+    data = [(f"user{i}", i % 1000) for i in range(size // 2, size + size // 2)]
+    ready = Event()
+    server = Process(target=run_party2, args=(args, data, ready))
+    server.start()
+    try:
+        while not ready.wait(0.1):
+            if not server.is_alive():
+                raise RuntimeError(f"P2 在开始监听前退出 (exitcode={server.exitcode})")
+        result = run_party1(args, iter(items))
+        server.join()
+    finally:
+        if server.is_alive():
+            server.terminate()
+        server.join()
+    expected = (size - size // 2, sum(v for w, v in data if int(w[4:]) < size))
+    print(f"\n结果正确: {tuple(result) == expected}")
+    return result
+if __name__ == "__main__":
+    main()
\ No newline at end of file